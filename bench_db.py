@@ -0,0 +1,298 @@
+"""Генератор синтетических баз и бенчмарк SQL-запросов бота.
+
+Примеры:
+    python bench_db.py generate --orders 1000000 --out bench_1m.db
+    python bench_db.py run --sizes 10000,100000,1000000 --out results.json
+
+Схема берётся из bot.init_db(), запросы — из SQL-констант bot.py, которые
+используют хендлеры и фоновые задачи бота.
+Результат `run` — JSON, удобный для сравнения между релизами.
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import statistics
+from uuid import uuid4
+from datetime import datetime, timedelta
+
+# bot.py требует токен при импорте; для работы со схемой он не нужен
+os.environ.setdefault("BOT_TOKEN", "benchmark")
+import bot
+
+BATCH_SIZE = 50000
+
+# Индексы-кандидаты, которые сравниваем с базовой схемой
+BENCH_INDEXES = {
+    "idx_orders_user_created": "CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders(user_id, created_at)",
+    "idx_orders_status_created": "CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(status, created_at)",
+    "idx_offers_title": "CREATE INDEX IF NOT EXISTS idx_offers_title ON offers(title)",
+}
+
+
+def _offers_by_ids_sql(n):
+    # Запрос fetch_offers при оформлении корзины из n позиций
+    return bot.SQL_OFFERS_BY_IDS.format(columns="id, title, description, price",
+                                        placeholders=",".join("?" * n))
+
+
+# name -> (SQL, функция параметров от метаданных датасета, изменяет ли данные).
+# SQL берётся из констант bot.py, поэтому замеры не расходятся с хендлерами.
+# Изменяющие запросы выполняются в транзакции и откатываются после каждого замера
+QUERIES = {
+    "my_orders_heavy_user": (bot.SQL_MY_ORDERS, lambda meta: (meta["heavy_user"],), False),
+    "my_orders_typical_user": (bot.SQL_MY_ORDERS, lambda meta: (meta["typical_user"],), False),
+    "stats_total": (bot.SQL_STATS_TOTAL, lambda meta: (), False),
+    "stats_today": (bot.SQL_STATS_TODAY, lambda meta: (meta["today"],), False),
+    "stats_offers_count": (bot.SQL_COUNT_OFFERS, lambda meta: (), False),
+    "stats_demo_count": (bot.SQL_COUNT_DEMO_USERS, lambda meta: (), False),
+    "state_user_state_count": (bot.SQL_COUNT_USER_STATE, lambda meta: (), False),
+    "list_demo_users_page": (bot.SQL_DEMO_USERS_PAGE, lambda meta: (bot.DEMO_PAGE_SIZE + 1, 0), False),
+    "show_offers_catalog": (bot.SQL_CATALOG, lambda meta: (), False),
+    "list_offers_admin_page": (bot.SQL_ADMIN_OFFERS_PAGE, lambda meta: (bot.OFFERS_PAGE_SIZE + 1, 0), False),
+    "buy_offer_lookup": (bot.SQL_OFFER_BY_ID, lambda meta: (meta["offer_id"],), False),
+    "cart_fetch_offers": (
+        _offers_by_ids_sql(bot.CART_MAX_ITEMS),
+        lambda meta: tuple(meta["cart_offer_ids"]),
+        False),
+    "offers_version": (bot.SQL_OFFERS_VERSION, lambda meta: (), False),
+    "is_demo_user": (bot.SQL_IS_DEMO_USER, lambda meta: (meta["typical_user"], meta["now"]), False),
+    "demo_expiry_sweep_batch": (bot.SQL_DEMO_SWEEP, lambda meta: (meta["now"], bot.DEMO_SWEEP_BATCH), True),
+    "load_user_state": (bot.SQL_LOAD_USER_STATE, lambda meta: (meta["typical_user"],), False),
+    "user_state_cleanup": (bot.SQL_USER_STATE_CLEANUP, lambda meta: (meta["state_cutoff"],), True),
+}
+
+TITLE_WORDS = ["Экспресс", "Ординар", "Тотал", "Футбол", "Хоккей", "Теннис",
+               "Лига", "Кубок", "Матч", "Фора", "Прогноз", "VIP", "Дубль", "Серия"]
+
+
+def _zipf_cum_weights(n, s):
+    # Кумулятивные веса 1/k^s — несколько «тяжёлых» пользователей/офферов и длинный хвост
+    total = 0.0
+    cum = []
+    for k in range(1, n + 1):
+        total += 1.0 / k ** s
+        cum.append(total)
+    return cum
+
+
+def generate(path, orders, users, offers, demo_users, days, skew, seed):
+    if os.path.exists(path):
+        os.remove(path)
+    rnd = random.Random(seed)
+
+    bot.DB = path
+    bot.init_db()
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    cur = conn.cursor()
+
+    offer_ids = [str(uuid4()) for _ in range(offers)]
+    cur.executemany("INSERT INTO offers VALUES(?,?,?,?)", [
+        (offer_id,
+         " ".join(rnd.sample(TITLE_WORDS, 3)) + f" #{i}",
+         f"Описание оффера #{i}",
+         rnd.choice([50000, 70000, 120000, 250000]))
+        for i, offer_id in enumerate(offer_ids)
+    ])
+
+    now = datetime.utcnow()
+    # Половина демо-доступов временные, часть из них уже истекла
+    cur.executemany("""
+        INSERT INTO demo_exceptions (user_id, granted_by, granted_at, expires_at) VALUES (?, ?, ?, ?)
+    """, [
+        (user_id, 1, (now - timedelta(days=rnd.random() * days)).isoformat(),
+         (now + timedelta(days=rnd.uniform(-30, 30))).isoformat() if rnd.random() < 0.5 else None)
+        for user_id in rnd.sample(range(1, users + 1), min(demo_users, users))
+    ])
+
+    # Сохранённое состояние части пользователей; часть старше STATE_PERSIST_DAYS
+    cur.executemany("INSERT INTO user_state (user_id, data, saved_at) VALUES (?, ?, ?)", [
+        (user_id, json.dumps({"cart": [rnd.choice(offer_ids)]}, separators=(',', ':')),
+         (now - timedelta(days=rnd.random() * 2 * bot.STATE_PERSIST_DAYS)).isoformat())
+        for user_id in rnd.sample(range(1, users + 1), max(1, users // 10))
+    ])
+
+    # Пользователь с id=1 — самый активный, хвост — случайные редкие покупатели
+    user_weights = _zipf_cum_weights(users, skew)
+    offer_weights = _zipf_cum_weights(offers, skew)
+    user_range = range(1, users + 1)
+    seconds = days * 86400
+
+    done = 0
+    while done < orders:
+        n = min(BATCH_SIZE, orders - done)
+        batch_users = rnd.choices(user_range, cum_weights=user_weights, k=n)
+        batch_offers = rnd.choices(offer_ids, cum_weights=offer_weights, k=n)
+        rows = []
+        for user_id, offer_id in zip(batch_users, batch_offers):
+            is_demo = 1 if rnd.random() < 0.02 else 0
+            created_at = (now - timedelta(seconds=rnd.random() * seconds)).isoformat()
+            rows.append((str(uuid4()), user_id, offer_id, "paid", str(uuid4()),
+                         is_demo, 0 if is_demo else rnd.choice([50000, 70000, 120000]), created_at))
+        cur.executemany("""
+            INSERT INTO orders (id, user_id, offer_id, status, payload, is_demo, paid_amount, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.commit()
+        done += n
+        print(f"{path}: {done}/{orders} заказов", file=sys.stderr)
+
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+
+def dataset_meta(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT user_id FROM orders GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1")
+    row = cur.fetchone()
+    heavy_user = row[0] if row else 1
+    cur.execute("SELECT MAX(user_id) FROM orders")
+    max_user = cur.fetchone()[0] or 1
+    cur.execute("SELECT id FROM offers LIMIT 1 OFFSET (SELECT COUNT(*) / 2 FROM offers)")
+    row = cur.fetchone()
+    cur.execute("SELECT id FROM offers LIMIT ?", (bot.CART_MAX_ITEMS,))
+    cart_offer_ids = [r[0] for r in cur.fetchall()]
+    # Запрос корзины рассчитан на CART_MAX_ITEMS позиций; при малом каталоге повторяем id
+    cart_offer_ids = (cart_offer_ids * bot.CART_MAX_ITEMS)[:bot.CART_MAX_ITEMS] or [""] * bot.CART_MAX_ITEMS
+    now = datetime.utcnow()
+    return {
+        "heavy_user": heavy_user,
+        "typical_user": max_user // 2 or 1,
+        "offer_id": row[0] if row else "",
+        "cart_offer_ids": cart_offer_ids,
+        "today": now.date().isoformat(),
+        "now": now.isoformat(),
+        "state_cutoff": (now - timedelta(days=bot.STATE_PERSIST_DAYS)).isoformat(),
+    }
+
+
+def bench_queries(conn, meta, repeat):
+    results = {}
+    for name, (sql, params, write) in QUERIES.items():
+        args = params(meta)
+        plan = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, args)]
+        # Прогрев кэша страниц; для изменяющих запросов считаем затронутые строки
+        cur = conn.execute(sql, args)
+        rows = cur.rowcount if write else len(cur.fetchall())
+        if write:
+            conn.rollback()
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            conn.execute(sql, args).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+            if write:
+                conn.rollback()
+        results[name] = {
+            "rows": rows,
+            "min_ms": round(min(timings), 4),
+            "median_ms": round(statistics.median(timings), 4),
+            "mean_ms": round(statistics.mean(timings), 4),
+            "plan": plan,
+        }
+    return results
+
+
+def run(args):
+    os.makedirs(args.workdir, exist_ok=True)
+    report = {
+        "generated_at": datetime.utcnow().isoformat(),
+        "sqlite_version": sqlite3.sqlite_version,
+        "python_version": platform.python_version(),
+        "repeat": args.repeat,
+        "indexes": BENCH_INDEXES,
+        "datasets": [],
+    }
+
+    for orders in args.sizes:
+        users = max(1, int(orders * args.users_per_order))
+        path = os.path.join(args.workdir, f"bench_{orders}.db")
+        if args.regenerate or not os.path.exists(path):
+            generate(path, orders, users, args.offers, args.demo_users, args.days, args.skew, args.seed)
+
+        conn = sqlite3.connect(path)
+        for name in BENCH_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+        conn.execute("ANALYZE")
+        meta = dataset_meta(conn)
+        without_indexes = bench_queries(conn, meta, args.repeat)
+
+        for sql in BENCH_INDEXES.values():
+            conn.execute(sql)
+        conn.execute("ANALYZE")
+        conn.commit()
+        with_indexes = bench_queries(conn, meta, args.repeat)
+
+        # Оставляем файл в исходном виде, чтобы следующий запуск был сопоставим
+        for name in BENCH_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+        conn.commit()
+        conn.close()
+
+        report["datasets"].append({
+            "orders": orders,
+            "users": users,
+            "offers": args.offers,
+            "demo_users": args.demo_users,
+            "file_bytes": os.path.getsize(path),
+            "params": meta,
+            "without_indexes": without_indexes,
+            "with_indexes": with_indexes,
+        })
+        print(f"{path}: готово", file=sys.stderr)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out == "-":
+        print(text)
+    else:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+def _sizes(value):
+    return [int(x) for x in value.split(",") if x.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_dataset_args(p):
+        p.add_argument("--users-per-order", type=float, default=0.1,
+                       help="число пользователей как доля от числа заказов")
+        p.add_argument("--offers", type=int, default=200)
+        p.add_argument("--demo-users", type=int, default=500)
+        p.add_argument("--days", type=int, default=365, help="период, за который разбросаны заказы")
+        p.add_argument("--skew", type=float, default=1.1, help="показатель Zipf для пользователей и офферов")
+        p.add_argument("--seed", type=int, default=42)
+
+    gen = sub.add_parser("generate", help="создать одну синтетическую базу")
+    gen.add_argument("--orders", type=int, required=True)
+    gen.add_argument("--out", required=True)
+    add_dataset_args(gen)
+
+    bench = sub.add_parser("run", help="сгенерировать базы (если нужно) и замерить запросы")
+    bench.add_argument("--sizes", type=_sizes, default=[10000, 100000, 1000000])
+    bench.add_argument("--workdir", default="bench_data")
+    bench.add_argument("--regenerate", action="store_true")
+    bench.add_argument("--repeat", type=int, default=5)
+    bench.add_argument("--out", default="-", help="файл для JSON-отчёта, '-' — stdout")
+    add_dataset_args(bench)
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        users = max(1, int(args.orders * args.users_per_order))
+        generate(args.out, args.orders, users, args.offers, args.demo_users, args.days, args.skew, args.seed)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
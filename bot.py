@@ -1,6 +1,13 @@
 import os
+import re
+import json
 import logging
+import heapq
+import asyncio
+from bisect import bisect_left
 import sqlite3
+from collections import OrderedDict
+from itertools import islice
 from uuid import uuid4
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
@@ -8,6 +15,8 @@ from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
     LabeledPrice
 )
 from telegram.ext import (
@@ -19,7 +28,9 @@ from telegram.ext import (
     filters,
     PreCheckoutQueryHandler,
     CallbackQueryHandler,
-    ConversationHandler
+    ConversationHandler,
+    InlineQueryHandler,
+    TypeHandler
 )
 
 # Загрузка конфигурации
@@ -31,6 +42,26 @@ PROVIDER_TOKEN = os.getenv("PROVIDER_TOKEN", "")
 DB = os.getenv("DB_PATH", "store.db")
 ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()]
 PURCHASE_COOLDOWN_SECONDS = int(os.getenv("PURCHASE_COOLDOWN_SECONDS", "5"))
+ORDERS_CACHE_SIZE = int(os.getenv("ORDERS_CACHE_SIZE", "1000"))
+OFFERS_WATCH_INTERVAL_SECONDS = int(os.getenv("OFFERS_WATCH_INTERVAL_SECONDS", "30"))
+CONVERSATION_TIMEOUT_SECONDS = int(os.getenv("CONVERSATION_TIMEOUT_SECONDS", "600"))
+STATE_TTL_SECONDS = int(os.getenv("STATE_TTL_SECONDS", "3600"))
+# Лимиты — количество записей в памяти, а не байты; /state показывает примерный размер
+STATE_MAX_USERS = int(os.getenv("STATE_MAX_USERS", "10000"))
+STATE_MAX_CHATS = int(os.getenv("STATE_MAX_CHATS", "10000"))
+STATE_SWEEP_INTERVAL_SECONDS = int(os.getenv("STATE_SWEEP_INTERVAL_SECONDS", "60"))
+STATE_PERSIST = os.getenv("STATE_PERSIST", "1") == "1"
+STATE_PERSIST_DAYS = int(os.getenv("STATE_PERSIST_DAYS", "7"))
+CART_MAX_ITEMS = int(os.getenv("CART_MAX_ITEMS", "20"))
+PENDING_INVOICES_MAX = int(os.getenv("PENDING_INVOICES_MAX", "10"))
+OFFERS_PAGE_SIZE = int(os.getenv("OFFERS_PAGE_SIZE", "10"))
+INLINE_RESULTS_LIMIT = 50  # максимум Telegram для answer_inline_query
+DEMO_SWEEP_INTERVAL_SECONDS = int(os.getenv("DEMO_SWEEP_INTERVAL_SECONDS", "300"))
+DEMO_SWEEP_BATCH = max(1, int(os.getenv("DEMO_SWEEP_BATCH", "500")))
+DEMO_FILE_MAX_BYTES = 1024 * 1024
+DEMO_PAGE_SIZE = int(os.getenv("DEMO_PAGE_SIZE", "20"))
+DEMO_MAX_DURATION = timedelta(days=int(os.getenv("DEMO_MAX_DURATION_DAYS", "3650")))
+MAX_USER_ID = 2 ** 63 - 1  # INTEGER в SQLite
 
 if not BOT_TOKEN:
     raise SystemExit("Set BOT_TOKEN env var")
@@ -39,11 +70,66 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # States for conversation handler
-TITLE, DESC, PRICE, DEMO_USER_ID = range(4)
+TITLE, DESC, PRICE, DEMO_USER_ID, EDIT_TITLE = range(5)
 
 # In-memory rate-limit
 _last_purchase = {}
 
+# LRU-кэш отрендеренной истории заказов: user_id -> текст (None, если заказов нет)
+_orders_cache = OrderedDict()
+
+# Последняя увиденная версия таблицы offers (см. watch_offers)
+_offers_version = None
+
+# Каталог офферов в памяти с индексом по токенам названий
+_catalog = None
+_catalog_dirty = False
+_catalog_refresh = None
+
+# Время последней активности: user_id/chat_id -> datetime (старые в начале)
+_user_last_seen = OrderedDict()
+_chat_last_seen = OrderedDict()
+
+# SQL-запросы, которые бот выполняет на горячих путях и по расписанию.
+# Вынесены в константы, чтобы bench_db.py замерял ровно их
+SQL_MY_ORDERS = """
+    SELECT o.id, of.title, o.status, o.created_at, o.paid_amount, o.is_demo, o.payload
+    FROM orders o
+    JOIN offers of ON o.offer_id = of.id
+    WHERE o.user_id = ?
+    ORDER BY o.created_at DESC
+    LIMIT 50
+"""
+SQL_STATS_TOTAL = "SELECT COUNT(*), SUM(paid_amount) FROM orders WHERE status = 'paid'"
+SQL_STATS_TODAY = """
+    SELECT COUNT(*), SUM(paid_amount) FROM orders
+    WHERE status = 'paid' AND date(created_at) = ?
+"""
+SQL_COUNT_OFFERS = "SELECT COUNT(*) FROM offers"
+SQL_COUNT_DEMO_USERS = "SELECT COUNT(*) FROM demo_exceptions"
+SQL_COUNT_USER_STATE = "SELECT COUNT(*) FROM user_state"
+SQL_OFFER_BY_ID = "SELECT title, description, price FROM offers WHERE id = ?"
+# {columns} и {placeholders} подставляет fetch_offers
+SQL_OFFERS_BY_IDS = "SELECT {columns} FROM offers WHERE id IN ({placeholders})"
+SQL_CATALOG = "SELECT id, title, price FROM offers ORDER BY title"
+SQL_ADMIN_OFFERS_PAGE = "SELECT id, title, price FROM offers ORDER BY rowid LIMIT ? OFFSET ?"
+SQL_OFFERS_VERSION = "SELECT value FROM meta WHERE key = 'offers_version'"
+SQL_IS_DEMO_USER = "SELECT 1 FROM demo_exceptions WHERE user_id = ? AND (expires_at IS NULL OR expires_at > ?)"
+SQL_DEMO_USERS_PAGE = """
+    SELECT user_id, granted_by, granted_at, expires_at FROM demo_exceptions
+    ORDER BY granted_at DESC
+    LIMIT ? OFFSET ?
+"""
+SQL_DEMO_SWEEP = """
+    DELETE FROM demo_exceptions WHERE user_id IN (
+        SELECT user_id FROM demo_exceptions
+        WHERE expires_at IS NOT NULL AND expires_at <= ?
+        LIMIT ?
+    )
+"""
+SQL_LOAD_USER_STATE = "SELECT data FROM user_state WHERE user_id = ?"
+SQL_USER_STATE_CLEANUP = "DELETE FROM user_state WHERE saved_at < ?"
+
 ### База данных
 def _conn():
     return sqlite3.connect(DB)
@@ -71,9 +157,46 @@ def init_db():
     CREATE TABLE IF NOT EXISTS demo_exceptions(
         user_id INTEGER PRIMARY KEY,
         granted_by INTEGER,
-        granted_at TEXT
+        granted_at TEXT,
+        expires_at TEXT
     )
     """)
+    # Миграция старых баз: срок действия демо-доступа (NULL — бессрочно)
+    cur.execute("PRAGMA table_info(demo_exceptions)")
+    if 'expires_at' not in [row[1] for row in cur.fetchall()]:
+        cur.execute("ALTER TABLE demo_exceptions ADD COLUMN expires_at TEXT")
+    # Частичный индекс только по временным доступам — для очистки истёкших
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_demo_exceptions_expires
+    ON demo_exceptions(expires_at) WHERE expires_at IS NOT NULL
+    """)
+    # Для постраничного списка демо-пользователей (сортировка по дате выдачи)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_demo_exceptions_granted ON demo_exceptions(granted_at)")
+    # Счётчик изменений offers: триггеры срабатывают и при правке записей
+    # напрямую в БД, так что бот замечает изменения, сделанные в обход него
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS meta(
+        key TEXT PRIMARY KEY,
+        value INTEGER
+    )
+    """)
+    cur.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('offers_version', 0)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS offers_version_{event.lower()} AFTER {event} ON offers
+        BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'offers_version';
+        END
+        """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS user_state(
+        user_id INTEGER PRIMARY KEY,
+        data TEXT,
+        saved_at TEXT
+    )
+    """)
+    # Для периодического удаления устаревших сохранений в sweep_state
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_user_state_saved ON user_state(saved_at)")
     conn.commit()
     conn.close()
 
@@ -94,6 +217,15 @@ def add_sample_offers():
 def is_admin(user_id):
     return user_id in ADMIN_IDS
 
+def is_demo_user(user_id):
+    # Поиск по первичному ключу; истёкший, но ещё не удалённый доступ не действует
+    conn = _conn()
+    cur = conn.cursor()
+    cur.execute(SQL_IS_DEMO_USER, (user_id, datetime.utcnow().isoformat()))
+    found = cur.fetchone() is not None
+    conn.close()
+    return found
+
 ### Утилиты
 def rate_limit_ok(user_id):
     now = datetime.utcnow()
@@ -103,10 +235,311 @@ def rate_limit_ok(user_id):
     _last_purchase[user_id] = now
     return True
 
+def orders_cache_get(user_id):
+    # Возвращает (True, текст) при попадании в кэш, иначе (False, None)
+    if user_id not in _orders_cache:
+        return False, None
+    _orders_cache.move_to_end(user_id)
+    return True, _orders_cache[user_id]
+
+def orders_cache_put(user_id, text):
+    if ORDERS_CACHE_SIZE <= 0:
+        return
+    _orders_cache[user_id] = text
+    _orders_cache.move_to_end(user_id)
+    while len(_orders_cache) > ORDERS_CACHE_SIZE:
+        _orders_cache.popitem(last=False)
+
+def invalidate_orders_cache(user_id=None):
+    # Без user_id сбрасываем весь кэш (например, когда меняются офферы)
+    if user_id is None:
+        _orders_cache.clear()
+    else:
+        _orders_cache.pop(user_id, None)
+
+def get_offers_version():
+    conn = _conn()
+    cur = conn.cursor()
+    cur.execute(SQL_OFFERS_VERSION)
+    version = cur.fetchone()[0]
+    conn.close()
+    return version
+
+async def watch_offers(context: ContextTypes.DEFAULT_TYPE):
+    # Одно чтение по ключу раз в OFFERS_WATCH_INTERVAL_SECONDS вместо проверки
+    # при каждом обращении к кэшу: правки offers в обход бота (в т.ч. прямо в БД)
+    # попадают в историю заказов и каталог не позже чем через интервал
+    global _offers_version
+    version = get_offers_version()
+    if _offers_version is not None and version != _offers_version:
+        invalidate_orders_cache()
+        invalidate_catalog()
+    elif _catalog_dirty:
+        # Прошлая пересборка каталога не удалась — повторяем
+        invalidate_catalog()
+    _offers_version = version
+
+### Состояние пользователей и чатов
+# user_data/chat_data живут в памяти; неактивные записи выгружаются по TTL,
+# а при превышении STATE_MAX_USERS/STATE_MAX_CHATS (число записей, не байты)
+# — самые давние. Непустой user_data сохраняется компактным JSON в user_state
+# и подгружается при возвращении.
+def save_user_states(states):
+    # states: [(user_id, data), ...] — одна пачка и один коммит на всю выгрузку
+    if not states:
+        return
+    saved_at = datetime.utcnow().isoformat()
+    conn = _conn()
+    cur = conn.cursor()
+    cur.executemany(
+        "INSERT OR REPLACE INTO user_state (user_id, data, saved_at) VALUES (?, ?, ?)",
+        [(user_id, json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str), saved_at)
+         for user_id, data in states]
+    )
+    conn.commit()
+    conn.close()
+
+def load_user_state(user_id):
+    # Забираем сохранённое состояние и удаляем его из БД
+    conn = _conn()
+    cur = conn.cursor()
+    cur.execute(SQL_LOAD_USER_STATE, (user_id,))
+    row = cur.fetchone()
+    if row:
+        cur.execute("DELETE FROM user_state WHERE user_id = ?", (user_id,))
+        conn.commit()
+    conn.close()
+    return json.loads(row[0]) if row else None
+
+def evict_users(application: Application, user_ids):
+    # Пишем синхронно и до возврата в цикл событий: если пользователь вернётся
+    # сразу после выгрузки, track_activity уже найдёт его состояние в БД
+    states = []
+    for user_id in user_ids:
+        _user_last_seen.pop(user_id, None)
+        data = application.user_data.get(user_id)
+        if data and STATE_PERSIST:
+            states.append((user_id, dict(data)))
+    save_user_states(states)
+    for user_id in user_ids:
+        application.drop_user_data(user_id)
+
+def evict_chat(application: Application, chat_id):
+    _chat_last_seen.pop(chat_id, None)
+    application.drop_chat_data(chat_id)
+
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Выполняется до остальных хендлеров (group=-1)
+    now = datetime.utcnow()
+    user = update.effective_user
+    chat = update.effective_chat
+    
+    if user:
+        if user.id not in _user_last_seen and STATE_PERSIST:
+            data = load_user_state(user.id)
+            if data:
+                context.user_data.update(data)
+        _user_last_seen[user.id] = now
+        _user_last_seen.move_to_end(user.id)
+        if len(_user_last_seen) > STATE_MAX_USERS:
+            excess = len(_user_last_seen) - STATE_MAX_USERS
+            evict_users(context.application, list(islice(_user_last_seen, excess)))
+    
+    if chat:
+        _chat_last_seen[chat.id] = now
+        _chat_last_seen.move_to_end(chat.id)
+        while len(_chat_last_seen) > STATE_MAX_CHATS:
+            oldest = next(iter(_chat_last_seen))
+            evict_chat(context.application, oldest)
+
+async def sweep_state(context: ContextTypes.DEFAULT_TYPE):
+    application = context.application
+    now = datetime.utcnow()
+    deadline = now - timedelta(seconds=STATE_TTL_SECONDS)
+    
+    idle_users = []
+    for user_id, last in _user_last_seen.items():
+        if last >= deadline:
+            break
+        idle_users.append(user_id)
+    evict_users(application, idle_users)
+    evicted_users = len(idle_users)
+    
+    evicted_chats = 0
+    while _chat_last_seen:
+        chat_id, last = next(iter(_chat_last_seen.items()))
+        if last >= deadline:
+            break
+        evict_chat(application, chat_id)
+        evicted_chats += 1
+    
+    # Отметки rate-limit нужны только в пределах кулдауна
+    cooldown = timedelta(seconds=PURCHASE_COOLDOWN_SECONDS)
+    for user_id in [u for u, t in _last_purchase.items() if now - t >= cooldown]:
+        del _last_purchase[user_id]
+    
+    # Сохранённое состояние не храним вечно
+    conn = _conn()
+    cur = conn.cursor()
+    cur.execute(SQL_USER_STATE_CLEANUP, ((now - timedelta(days=STATE_PERSIST_DAYS)).isoformat(),))
+    conn.commit()
+    conn.close()
+    
+    if evicted_users or evicted_chats:
+        logger.info(f"Выгружено состояние: пользователей {evicted_users}, чатов {evicted_chats}")
+
+async def state_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Доступ запрещён")
+        return
+    
+    application = context.application
+    user_data = application.user_data
+    chat_data = application.chat_data
+    keys = sum(len(d) for d in user_data.values()) + sum(len(d) for d in chat_data.values())
+    size = sum(
+        len(json.dumps(d, ensure_ascii=False, default=str))
+        for d in list(user_data.values()) + list(chat_data.values())
+    )
+    
+    conn = _conn()
+    cur = conn.cursor()
+    cur.execute(SQL_COUNT_USER_STATE)
+    persisted = cur.fetchone()[0]
+    conn.close()
+    
+    text = "🧠 Состояние бота:\n\n"
+    text += f"👤 user_data: {len(user_data)} (лимит {STATE_MAX_USERS})\n"
+    text += f"💬 chat_data: {len(chat_data)} (лимит {STATE_MAX_CHATS})\n"
+    text += f"🔑 Ключей: {keys}, ~{size / 1024:.1f} КБ\n"
+    text += f"⏰ Rate-limit записей: {len(_last_purchase)}\n"
+    text += f"📋 Кэш заказов: {len(_orders_cache)} (лимит {ORDERS_CACHE_SIZE})\n"
+    text += f"💾 Сохранено в БД: {persisted}\n"
+    text += f"⌛ TTL: {STATE_TTL_SECONDS} с, таймаут диалогов: {CONVERSATION_TIMEOUT_SECONDS} с"
+    await update.message.reply_text(text)
+
+### Каталог и поиск
+# Офферы держим в памяти: страницы каталога и inline-поиск не ходят в БД.
+# Индекс — отсортированный список (токен, номер оффера); префикс ищется
+# бинарным поиском. После изменения офферов каталог пересобирается в отдельном
+# потоке, а до готовности запросы обслуживает предыдущая версия.
+def _tokens(text):
+    return re.findall(r"\w+", (text or "").lower().replace("ё", "е"))
+
+def build_catalog():
+    conn = _conn()
+    cur = conn.cursor()
+    cur.execute(SQL_CATALOG)
+    offers = cur.fetchall()
+    conn.close()
+    offer_tokens = [tuple(set(_tokens(title))) for _, title, _ in offers]
+    index = sorted((token, i) for i, tokens in enumerate(offer_tokens) for token in tokens)
+    return {
+        'offers': offers,
+        'offer_tokens': offer_tokens,
+        'tokens': [token for token, _ in index],
+        'positions': [i for _, i in index],
+    }
+
+def get_catalog():
+    global _catalog
+    if _catalog is None:
+        _catalog = build_catalog()
+    return _catalog
+
+async def _refresh_catalog():
+    global _catalog, _catalog_dirty
+    while _catalog_dirty:
+        _catalog_dirty = False
+        try:
+            _catalog = await asyncio.to_thread(build_catalog)
+        except Exception as e:
+            # Оставляем прежний каталог; флаг вернётся, и следующий
+            # invalidate_catalog() (или watch_offers) повторит сборку
+            logger.error(f"Error rebuilding catalog: {e}")
+            _catalog_dirty = True
+            return
+
+def invalidate_catalog():
+    # Вызывается из хендлеров: пересборка в фоне, повторные вызовы схлопываются
+    global _catalog_dirty, _catalog_refresh
+    _catalog_dirty = True
+    if _catalog_refresh is None or _catalog_refresh.done():
+        _catalog_refresh = asyncio.get_running_loop().create_task(_refresh_catalog())
+
+def _prefix_matches(catalog, prefix):
+    # Номера офферов, у которых есть токен с таким префиксом
+    tokens = catalog['tokens']
+    start = bisect_left(tokens, prefix)
+    end = bisect_left(tokens, prefix + "\uffff", start)
+    return catalog['positions'][start:end]
+
+def search_offers(text, offset=0, limit=INLINE_RESULTS_LIMIT):
+    catalog = get_catalog()
+    offers = catalog['offers']
+    words = _tokens(text)
+    if not words:
+        return offers[offset:offset + limit]
+    
+    # (слово, позиции) от самого редкого слова к самому частому
+    matches = sorted(((word, _prefix_matches(catalog, word)) for word in set(words)),
+                     key=lambda match: len(match[1]))
+    if len(matches) == 1:
+        # Одно слово: идём по диапазону индекса и останавливаемся на offset + limit
+        found = []
+        seen = set()
+        for i in matches[0][1]:
+            if i not in seen:
+                seen.add(i)
+                found.append(offers[i])
+                if len(found) >= offset + limit:
+                    break
+        return found[offset:]
+    
+    # Несколько слов: пересекаем множества от самого редкого. Если кандидатов
+    # осталось меньше, чем позиций у следующего слова, дешевле проверить их
+    # по заранее посчитанным токенам названия
+    offer_tokens = catalog['offer_tokens']
+    candidates = set(matches[0][1])
+    for word, positions in matches[1:]:
+        if not candidates:
+            break
+        if len(candidates) * 4 < len(positions):
+            candidates = {i for i in candidates
+                          if any(token.startswith(word) for token in offer_tokens[i])}
+        else:
+            candidates.intersection_update(positions)
+    return [offers[i] for i in heapq.nsmallest(offset + limit, candidates)][offset:]
+
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    inline_query = update.inline_query
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    # Берём на один результат больше, чтобы понять, есть ли следующая порция
+    offers = search_offers(inline_query.query, offset, INLINE_RESULTS_LIMIT + 1)
+    next_offset = str(offset + INLINE_RESULTS_LIMIT) if len(offers) > INLINE_RESULTS_LIMIT else ""
+    
+    results = []
+    for offer_id, title, price in offers[:INLINE_RESULTS_LIMIT]:
+        url = f"https://t.me/{context.bot.username}?start=offer_{offer_id}"
+        results.append(InlineQueryResultArticle(
+            id=offer_id,
+            title=title,
+            description=f"{price/100:.0f} ₽",
+            input_message_content=InputTextMessageContent(f"🎯 {title} — {price/100:.0f} ₽"),
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🛍️ Открыть в боте", url=url)]])
+        ))
+    
+    await inline_query.answer(results, cache_time=10, is_personal=False, next_offset=next_offset)
+
 ### Основное меню
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
+    # Переход по ссылке из inline-поиска: /start offer_{offer_id}
+    if update.message and context.args and context.args[0].startswith('offer_'):
+        await show_offer_card(update, context, context.args[0][len('offer_'):])
+        return
+    
     if is_admin(user.id):
         keyboard = [
             [InlineKeyboardButton("🎯 Доступные офферы", callback_data='show_offers')],
@@ -170,7 +603,7 @@ async def manage_demo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=reply_markup
     )
 
-async def list_demo_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def list_demo_users(update: Update, context: ContextTypes.DEFAULT_TYPE, page=None):
     query = update.callback_query
     await query.answer()
     
@@ -178,12 +611,25 @@ async def list_demo_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.message.reply_text("❌ Доступ запрещён")
         return
     
+    if page is None:
+        page = int(query.data[len('demo_page_'):]) if query.data.startswith('demo_page_') else 0
+    
+    # Берём на одну запись больше, чтобы понять, есть ли следующая страница.
+    # Если страница опустела (например, после удаления), показываем последнюю
     conn = _conn()
     cur = conn.cursor()
-    cur.execute("SELECT user_id, granted_by, granted_at FROM demo_exceptions")
+    cur.execute(SQL_DEMO_USERS_PAGE, (DEMO_PAGE_SIZE + 1, page * DEMO_PAGE_SIZE))
     demo_users = cur.fetchall()
+    if not demo_users and page > 0:
+        cur.execute(SQL_COUNT_DEMO_USERS)
+        page = max(0, cur.fetchone()[0] - 1) // DEMO_PAGE_SIZE
+        cur.execute(SQL_DEMO_USERS_PAGE, (DEMO_PAGE_SIZE + 1, page * DEMO_PAGE_SIZE))
+        demo_users = cur.fetchall()
     conn.close()
     
+    has_next = len(demo_users) > DEMO_PAGE_SIZE
+    demo_users = demo_users[:DEMO_PAGE_SIZE]
+    
     if not demo_users:
         keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='manage_demo')]]
         await query.message.reply_text(
@@ -192,16 +638,25 @@ async def list_demo_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    text = "📋 Пользователи с демо-доступом:\n\n"
+    text = f"📋 Пользователи с демо-доступом (стр. {page + 1}):\n\n"
     keyboard = []
     
-    for user_id, granted_by, granted_at in demo_users:
+    for user_id, granted_by, granted_at, expires_at in demo_users:
         date = granted_at[:19].replace('T', ' ') if granted_at else "Неизвестно"
-        text += f"👤 ID: {user_id}\n📅 Добавлен: {date}\n👨‍💼 Админ ID: {granted_by}\n\n"
+        expires = expires_at[:19].replace('T', ' ') if expires_at else "бессрочно"
+        text += f"👤 ID: {user_id}\n📅 Добавлен: {date}\n⏳ До: {expires}\n👨‍💼 Админ ID: {granted_by}\n\n"
         keyboard.append([
-            InlineKeyboardButton(f"🗑️ Удалить {user_id}", callback_data=f'remove_demo_{user_id}')
+            InlineKeyboardButton(f"🗑️ Удалить {user_id}", callback_data=f'remove_demo_{user_id}_{page}')
         ])
     
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️", callback_data=f'demo_page_{page - 1}'))
+    if has_next:
+        nav.append(InlineKeyboardButton("▶️", callback_data=f'demo_page_{page + 1}'))
+    if nav:
+        keyboard.append(nav)
+    
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='manage_demo')])
     await query.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
@@ -213,7 +668,9 @@ async def remove_demo_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.message.reply_text("❌ Доступ запрещён")
         return
     
-    user_id = query.data.split('_')[2]  # remove_demo_{user_id}
+    parts = query.data.split('_')  # remove_demo_{user_id}_{page}
+    user_id = parts[2]
+    page = int(parts[3]) if len(parts) > 3 else 0
     
     conn = _conn()
     cur = conn.cursor()
@@ -223,7 +680,7 @@ async def remove_demo_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await query.message.reply_text(f"✅ Демо-доступ для пользователя {user_id} удален")
     # Показываем обновленный список
-    await list_demo_users(update, context)
+    await list_demo_users(update, context, page)
 
 ### Работа с офферами
 # Показываем пользователям только название и цену, описание скрыто до покупки
@@ -231,11 +688,8 @@ async def show_offers(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    conn = _conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id, title, price FROM offers")
-    offers = cur.fetchall()
-    conn.close()
+    page = int(query.data[len('offers_page_'):]) if query.data.startswith('offers_page_') else 0
+    offers = get_catalog()['offers']
     
     if not offers:
         keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='back_to_main')]]
@@ -245,22 +699,51 @@ async def show_offers(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
+    pages = (len(offers) + OFFERS_PAGE_SIZE - 1) // OFFERS_PAGE_SIZE
+    page = max(0, min(page, pages - 1))
+    
     keyboard = []
-    for offer_id, title, price in offers:
+    for offer_id, title, price in offers[page * OFFERS_PAGE_SIZE:(page + 1) * OFFERS_PAGE_SIZE]:
         keyboard.append([
             InlineKeyboardButton(
                 f"{title} ({price/100:.0f} ₽)",
                 callback_data=f'buy_{offer_id}'
-            )
+            ),
+            InlineKeyboardButton("🛒 В корзину", callback_data=f'cart_add_{offer_id}')
         ])
     
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️", callback_data=f'offers_page_{page - 1}'))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("▶️", callback_data=f'offers_page_{page + 1}'))
+    if nav:
+        keyboard.append(nav)
+    
+    keyboard.append([InlineKeyboardButton("🔍 Поиск", switch_inline_query_current_chat="")])
+    keyboard.append([InlineKeyboardButton("🛒 Корзина", callback_data='show_cart')])
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='back_to_main')])
     
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.message.reply_text(
-        "🎯 Доступные офферы:",
-        reply_markup=reply_markup
-    )
+    text = "🎯 Доступные офферы:"
+    if pages > 1:
+        text = f"🎯 Доступные офферы (стр. {page + 1}/{pages}):"
+    await query.message.reply_text(text, reply_markup=reply_markup)
+
+async def show_offer_card(update: Update, context: ContextTypes.DEFAULT_TYPE, offer_id):
+    offers = fetch_offers([offer_id])
+    if not offers:
+        await update.message.reply_text("❌ Оффер не найден")
+        return
+    
+    _, title, price = offers[0]
+    keyboard = [
+        [InlineKeyboardButton(f"💳 Купить ({price/100:.0f} ₽)", callback_data=f'buy_{offer_id}')],
+        [InlineKeyboardButton("🛒 В корзину", callback_data=f'cart_add_{offer_id}')],
+        [InlineKeyboardButton("🎯 Все офферы", callback_data='show_offers')]
+    ]
+    await update.message.reply_text(f"🎯 {title}\n💰 Цена: {price/100:.0f} ₽",
+                                    reply_markup=InlineKeyboardMarkup(keyboard))
 
 ### Обработка покупки
 async def buy_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -275,7 +758,7 @@ async def buy_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     conn = _conn()
     cur = conn.cursor()
-    cur.execute("SELECT title, description, price FROM offers WHERE id=?", (offer_id,))
+    cur.execute(SQL_OFFER_BY_ID, (offer_id,))
     offer = cur.fetchone()
     conn.close()
     
@@ -286,13 +769,7 @@ async def buy_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     title, description, price = offer
     
     # Проверка демо-доступа
-    is_demo = False
-    conn = _conn()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM demo_exceptions WHERE user_id=?", (query.from_user.id,))
-    if cur.fetchone()[0] > 0:
-        is_demo = True
-    conn.close()
+    is_demo = is_demo_user(query.from_user.id)
     
     payload = str(uuid4())
     
@@ -307,6 +784,7 @@ async def buy_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """, (order_id, query.from_user.id, offer_id, payload, datetime.utcnow().isoformat()))
         conn.commit()
         conn.close()
+        invalidate_orders_cache(query.from_user.id)
         
         await query.message.reply_text(
             f"🎉 Демо-доступ предоставлен!\n"
@@ -330,86 +808,244 @@ async def buy_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             
             # Сохраняем информацию о заказе
-            context.user_data['offer_id'] = offer_id
-            context.user_data['payload'] = payload
+            remember_invoice(context, payload, [[offer_id, title, price]])
             
         except Exception as e:
             logger.error(f"Error sending invoice: {e}")
             await query.message.reply_text("❌ Ошибка при создании счета. Попробуйте позже.")
 
+### Выставленные счета
+# user_data['pending_invoices']: payload -> {'lines': [[offer_id, title, price], ...],
+# 'cart': bool}. Оплата сопоставляется со счётом только по payload, поэтому
+# повторное нажатие «Купить»/«Оформить» не путает заказы. Храним последние
+# PENDING_INVOICES_MAX счетов.
+def remember_invoice(context: ContextTypes.DEFAULT_TYPE, payload, lines, cart=False):
+    pending = context.user_data.setdefault('pending_invoices', {})
+    pending[payload] = {'lines': lines, 'cart': cart}
+    while len(pending) > PENDING_INVOICES_MAX:
+        del pending[next(iter(pending))]
+
+### Корзина
+# В user_data['cart'] лежит список offer_id. Оформление — один счёт с
+# несколькими LabeledPrice и одна транзакция при успешной оплате.
+def fetch_offers(offer_ids, columns="id, title, price"):
+    # Офферы одним запросом, в порядке offer_ids; удалённые пропускаются
+    if not offer_ids:
+        return []
+    conn = _conn()
+    cur = conn.cursor()
+    placeholders = ",".join("?" * len(offer_ids))
+    cur.execute(SQL_OFFERS_BY_IDS.format(columns=columns, placeholders=placeholders), list(offer_ids))
+    rows = {row[0]: row for row in cur.fetchall()}
+    conn.close()
+    return [rows[offer_id] for offer_id in offer_ids if offer_id in rows]
+
+async def cart_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    offer_id = query.data[len('cart_add_'):]
+    cart = context.user_data.setdefault('cart', [])
+    
+    if offer_id in cart:
+        await query.answer("Уже в корзине")
+        return
+    if len(cart) >= CART_MAX_ITEMS:
+        await query.answer(f"В корзине не больше {CART_MAX_ITEMS} товаров", show_alert=True)
+        return
+    if not fetch_offers([offer_id]):
+        await query.answer("❌ Оффер не найден", show_alert=True)
+        return
+    
+    cart.append(offer_id)
+    await query.answer(f"🛒 Добавлено. В корзине: {len(cart)}")
+
+async def show_cart(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    offers = fetch_offers(context.user_data.get('cart', []))
+    # Удалённые офферы тихо убираем из корзины
+    context.user_data['cart'] = [offer_id for offer_id, _, _ in offers]
+    
+    if not offers:
+        keyboard = [
+            [InlineKeyboardButton("🎯 Доступные офферы", callback_data='show_offers')],
+            [InlineKeyboardButton("🔙 Назад", callback_data='back_to_main')]
+        ]
+        await query.message.reply_text("🛒 Корзина пуста", reply_markup=InlineKeyboardMarkup(keyboard))
+        return
+    
+    text = "🛒 Ваша корзина:\n\n"
+    keyboard = []
+    for offer_id, title, price in offers:
+        text += f"• {title} — {price/100:.0f} ₽\n"
+        keyboard.append([
+            InlineKeyboardButton(f"❌ Убрать «{title}»", callback_data=f'cart_remove_{offer_id}')
+        ])
+    total = sum(price for _, _, price in offers)
+    text += f"\n💰 Итого: {total/100:.0f} ₽"
+    
+    keyboard.append([InlineKeyboardButton("💳 Оформить", callback_data='cart_checkout')])
+    keyboard.append([InlineKeyboardButton("🗑️ Очистить", callback_data='cart_clear')])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='show_offers')])
+    await query.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def cart_remove(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    offer_id = update.callback_query.data[len('cart_remove_'):]
+    cart = context.user_data.get('cart', [])
+    if offer_id in cart:
+        cart.remove(offer_id)
+    await show_cart(update, context)
+
+async def cart_clear(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data.pop('cart', None)
+    await show_cart(update, context)
+
+async def cart_checkout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    if not rate_limit_ok(query.from_user.id):
+        await query.message.reply_text("⏰ Слишком частые запросы. Попробуйте позже.")
+        return
+    
+    offers = fetch_offers(context.user_data.get('cart', []), "id, title, description, price")
+    if not offers:
+        await query.message.reply_text("🛒 Корзина пуста")
+        return
+    
+    user_id = query.from_user.id
+    payload = str(uuid4())
+    
+    if is_demo_user(user_id):
+        # Демо-доступ — все позиции одной транзакцией
+        now = datetime.utcnow().isoformat()
+        conn = _conn()
+        cur = conn.cursor()
+        cur.executemany("""
+            INSERT INTO orders (id, user_id, offer_id, status, payload, is_demo, created_at)
+            VALUES (?, ?, ?, 'paid', ?, 1, ?)
+        """, [(str(uuid4()), user_id, offer_id, payload, now) for offer_id, _, _, _ in offers])
+        conn.commit()
+        conn.close()
+        invalidate_orders_cache(user_id)
+        context.user_data.pop('cart', None)
+        
+        text = "🎉 Демо-доступ предоставлен!\n\n"
+        for _, title, description, _ in offers:
+            text += f"📦 {title}\n📝 {description}\n\n"
+        text += "✅ Статус: Активен"
+        await query.message.reply_text(text)
+        return
+    
+    try:
+        await context.bot.send_invoice(
+            chat_id=user_id,
+            title=f"Корзина: {len(offers)} шт.",
+            description="Оплата товаров",
+            payload=payload,
+            provider_token=PROVIDER_TOKEN,
+            currency='RUB',
+            prices=[LabeledPrice(title, price) for _, title, _, price in offers],
+            max_tip_amount=50000,
+            suggested_tip_amounts=[5000, 10000, 20000, 50000]
+        )
+        
+        # Фиксируем позиции счёта: при оплате записываем ровно их,
+        # даже если оффер успели удалить или изменить
+        remember_invoice(
+            context, payload,
+            [[offer_id, title, price] for offer_id, title, _, price in offers],
+            cart=True
+        )
+        
+    except Exception as e:
+        logger.error(f"Error sending cart invoice: {e}")
+        await query.message.reply_text("❌ Ошибка при создании счета. Попробуйте позже.")
+
 ### Обработка пречека
 async def checkout(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.pre_checkout_query
     
-    # Можно добавить дополнительные проверки
+    # Не списываем деньги по счёту, состав которого уже не сможем восстановить
+    if query.invoice_payload not in context.user_data.get('pending_invoices', {}):
+        await query.answer(ok=False, error_message="Счёт устарел. Оформите покупку заново.")
+        return
     await query.answer(ok=True)
 
 ### Обработка успешной оплаты
-async def successful_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def record_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, lines):
+    # Все позиции счёта одной транзакцией
     payment = update.message.successful_payment
+    user_id = update.effective_user.id
     
-    # Логирование успешной оплаты
-    logger.info(f"Успешная оплата: {payment.total_amount} {payment.currency} "
-                f"от пользователя {update.effective_user.id}")
-    
-    # Создание записи о заказе
-    order_id = str(uuid4())
-    offer_id = context.user_data.get('offer_id')
+    # Каждая строка получает свою цену, чаевые относим к первой позиции,
+    # чтобы сумма paid_amount совпадала с total_amount
+    tip = payment.total_amount - sum(price for _, _, price in lines)
+    now = datetime.utcnow().isoformat()
+    rows = []
+    for i, (offer_id, _, price) in enumerate(lines):
+        amount = price + tip if i == 0 else price
+        rows.append((str(uuid4()), user_id, offer_id, payment.telegram_payment_charge_id, amount, now))
     
-    description = ''
-    if offer_id:
-        conn = _conn()
-        cur = conn.cursor()
-        # Получим описание оффера, чтобы показать его клиенту только после оплаты
-        cur.execute("SELECT description FROM offers WHERE id = ?", (offer_id,))
-        row = cur.fetchone()
-        if row:
-            description = row[0] or ''
-        cur.execute("""
-            INSERT INTO orders (id, user_id, offer_id, status, payload, paid_amount, created_at)
-            VALUES (?, ?, ?, 'paid', ?, ?, ?)
-        """, (order_id, update.effective_user.id, offer_id, payment.telegram_payment_charge_id, 
-              payment.total_amount, datetime.utcnow().isoformat()))
-        conn.commit()
-        conn.close()
+    conn = _conn()
+    cur = conn.cursor()
+    cur.executemany("""
+        INSERT INTO orders (id, user_id, offer_id, status, payload, paid_amount, created_at)
+        VALUES (?, ?, ?, 'paid', ?, ?, ?)
+    """, rows)
+    conn.commit()
+    conn.close()
+    invalidate_orders_cache(user_id)
     
-    # Отправка подтверждения покупки и описания
     msg = (
         f"🎉 Покупка успешно завершена!\n"
         f"💰 Сумма: {payment.total_amount / 100:.0f} ₽\n"
         f"🆔 ID транзакции: {payment.telegram_payment_charge_id}\n\n"
     )
-    if description:
-        msg += f"📝 Описание товара:\n{description}\n\n"
-    msg += "✅ Доступ к товару активирован!"
-
+    # Описания показываем только после оплаты; у удалённых офферов их уже нет
+    descriptions = dict(fetch_offers([offer_id for offer_id, _, _ in lines], "id, description"))
+    for offer_id, title, _ in lines:
+        msg += f"📦 {title}\n"
+        if descriptions.get(offer_id):
+            msg += f"📝 {descriptions[offer_id]}\n"
+        msg += "\n"
+    msg += "✅ Доступ к товару активирован!" if len(lines) == 1 else "✅ Доступ к товарам активирован!"
+    
     await update.message.reply_text(msg)
 
-### Мои заказы (история покупок у клиента)
-async def my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
+async def successful_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    payment = update.message.successful_payment
     
+    # Логирование успешной оплаты
+    logger.info(f"Успешная оплата: {payment.total_amount} {payment.currency} "
+                f"от пользователя {update.effective_user.id}")
+    
+    invoice = context.user_data.get('pending_invoices', {}).pop(payment.invoice_payload, None)
+    if not invoice:
+        # Счёт неизвестен (например, вытеснен более новыми) — не угадываем состав заказа
+        logger.error(f"Оплата с неизвестным payload {payment.invoice_payload}: "
+                     f"пользователь {update.effective_user.id}, "
+                     f"транзакция {payment.telegram_payment_charge_id}")
+        await update.message.reply_text(
+            f"⚠️ Оплата получена, но заказ не найден. Обратитесь к администратору, "
+            f"указав ID транзакции: {payment.telegram_payment_charge_id}"
+        )
+        return
+    
+    if invoice['cart']:
+        context.user_data.pop('cart', None)
+    await record_payment(update, context, invoice['lines'])
+
+### Мои заказы (история покупок у клиента)
+def render_orders(user_id):
     conn = _conn()
     cur = conn.cursor()
-    cur.execute("""
-        SELECT o.id, of.title, o.status, o.created_at, o.paid_amount, o.is_demo, o.payload
-        FROM orders o
-        JOIN offers of ON o.offer_id = of.id
-        WHERE o.user_id = ?
-        ORDER BY o.created_at DESC
-        LIMIT 50
-    """, (query.from_user.id,))
+    cur.execute(SQL_MY_ORDERS, (user_id,))
     orders = cur.fetchall()
     conn.close()
     
     if not orders:
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='back_to_main')]]
-        await query.message.reply_text(
-            "📭 У вас пока нет заказов",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        return
+        return None
     
     text = "📋 Ваша история покупок (последние 50):\n\n"
     for order_id, title, status, created_at, paid_amount, is_demo, payload in orders:
@@ -419,6 +1055,25 @@ async def my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
         date = created_at[:19].replace('T', ' ')
         text += f"{demo_mark}{status_emoji} {title} — {amount}\n"
         text += f"📅 {date} — ID заказа: {order_id}\n\n"
+    return text
+
+async def my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = query.from_user.id
+    hit, text = orders_cache_get(user_id)
+    if not hit:
+        text = render_orders(user_id)
+        orders_cache_put(user_id, text)
+    
+    if not text:
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='back_to_main')]]
+        await query.message.reply_text(
+            "📭 У вас пока нет заказов",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return
     
     keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='back_to_main')]]
     await query.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
@@ -443,19 +1098,32 @@ async def manage_offers(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 # --- Новые/обновлённые хендлеры для управления офферами ---
-async def list_offers_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def list_offers_admin(update: Update, context: ContextTypes.DEFAULT_TYPE, page=None):
     query = update.callback_query
     await query.answer()
     if not is_admin(query.from_user.id):
         await query.message.reply_text("❌ Доступ запрещён")
         return
 
+    if page is None:
+        page = int(query.data[len('admin_offers_page_'):]) if query.data.startswith('admin_offers_page_') else 0
+
+    # Читаем из БД, а не из каталога: после удаления список должен быть точным.
+    # Берём на одну запись больше, чтобы понять, есть ли следующая страница
     conn = _conn()
     cur = conn.cursor()
-    cur.execute("SELECT id, title, price FROM offers")
+    cur.execute(SQL_ADMIN_OFFERS_PAGE, (OFFERS_PAGE_SIZE + 1, page * OFFERS_PAGE_SIZE))
     offers = cur.fetchall()
+    if not offers and page > 0:
+        cur.execute(SQL_COUNT_OFFERS)
+        page = max(0, cur.fetchone()[0] - 1) // OFFERS_PAGE_SIZE
+        cur.execute(SQL_ADMIN_OFFERS_PAGE, (OFFERS_PAGE_SIZE + 1, page * OFFERS_PAGE_SIZE))
+        offers = cur.fetchall()
     conn.close()
 
+    has_next = len(offers) > OFFERS_PAGE_SIZE
+    offers = offers[:OFFERS_PAGE_SIZE]
+
     if not offers:
         keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='manage_offers')]]
         await query.message.reply_text("📭 Офферов пока нет", reply_markup=InlineKeyboardMarkup(keyboard))
@@ -465,12 +1133,20 @@ async def list_offers_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     for offer_id, title, price in offers:
         keyboard.append([
             InlineKeyboardButton(f"{title} ({price/100:.0f} ₽)", callback_data=f'edit_offer_{offer_id}'),
-            InlineKeyboardButton("🗑️ Удалить", callback_data=f'delete_offer_{offer_id}')
+            InlineKeyboardButton("🗑️ Удалить", callback_data=f'delete_offer_{offer_id}_{page}')
         ])
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️", callback_data=f'admin_offers_page_{page - 1}'))
+    if has_next:
+        nav.append(InlineKeyboardButton("▶️", callback_data=f'admin_offers_page_{page + 1}'))
+    if nav:
+        keyboard.append(nav)
     keyboard.append([InlineKeyboardButton("➕ Добавить оффер", callback_data='add_offer')])
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='manage_offers')])
 
-    await query.message.reply_text("📋 Список офферов (админ):", reply_markup=InlineKeyboardMarkup(keyboard))
+    await query.message.reply_text(f"📋 Список офферов (админ, стр. {page + 1}):",
+                                   reply_markup=InlineKeyboardMarkup(keyboard))
 
 
 async def delete_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -478,18 +1154,23 @@ async def delete_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     if not is_admin(query.from_user.id):
         return
-    offer_id = query.data[len('delete_offer_'):]
+    # delete_offer_{offer_id}_{page}; id офферов — UUID, в них нет '_'
+    offer_id, _, page = query.data[len('delete_offer_'):].partition('_')
+    page = int(page) if page.isdigit() else 0
     conn = _conn()
     cur = conn.cursor()
     cur.execute("DELETE FROM offers WHERE id = ?", (offer_id,))
     conn.commit()
     conn.close()
+    # Заказы по удалённому офферу пропадают из истории у всех пользователей
+    invalidate_orders_cache()
+    invalidate_catalog()
     await query.message.reply_text("✅ Оффер удален")
     # Обновим список после удаления
-    await list_offers_admin(update, context)
+    await list_offers_admin(update, context, page)
 
 
-async def edit_offer_placeholder(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def edit_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     if not is_admin(query.from_user.id):
@@ -497,18 +1178,63 @@ async def edit_offer_placeholder(update: Update, context: ContextTypes.DEFAULT_T
     offer_id = query.data[len('edit_offer_'):]
     conn = _conn()
     cur = conn.cursor()
-    cur.execute("SELECT title, description, price FROM offers WHERE id = ?", (offer_id,))
+    cur.execute(SQL_OFFER_BY_ID, (offer_id,))
     row = cur.fetchone()
     conn.close()
     if not row:
         await query.message.reply_text("❌ Оффер не найден")
         return
     title, desc, price = row
+    keyboard = [
+        [InlineKeyboardButton("✏️ Изменить название", callback_data=f'edit_title_{offer_id}')],
+        [InlineKeyboardButton("🔙 Назад", callback_data='list_offers')]
+    ]
     await query.message.reply_text(
         f"✏️ Оффер:\n\n{title}\nЦена: {price/100:.0f} ₽\n\n"
-        "Чтобы изменить описание, нужно редактировать запись в БД. Описание не показывается клиентам до покупки."
+        "Чтобы изменить описание, нужно редактировать запись в БД. Описание не показывается клиентам до покупки.",
+        reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
+# --- Conversation: Изменение названия оффера ---
+async def start_edit_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    if not is_admin(query.from_user.id):
+        await query.message.reply_text("❌ Доступ запрещён")
+        return ConversationHandler.END
+    context.user_data['edit_offer_id'] = query.data[len('edit_title_'):]
+    await query.message.reply_text("✏️ Введите новое название оффера (или /cancel чтобы отменить):")
+    return EDIT_TITLE
+
+async def edit_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    title = update.message.text.strip()
+    if not title:
+        await update.message.reply_text("Ошибка: название не может быть пустым")
+        return EDIT_TITLE
+    offer_id = context.user_data.pop('edit_offer_id', None)
+    conn = _conn()
+    cur = conn.cursor()
+    cur.execute("UPDATE offers SET title = ? WHERE id = ?", (title, offer_id))
+    updated = cur.rowcount
+    conn.commit()
+    conn.close()
+    if not updated:
+        await update.message.reply_text("❌ Оффер не найден")
+        return ConversationHandler.END
+    # Название показывается в истории заказов всех покупателей и в каталоге
+    invalidate_orders_cache()
+    invalidate_catalog()
+    await update.message.reply_text(f"✅ Название изменено: {title}")
+    return ConversationHandler.END
+
+async def cancel_edit_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data.pop('edit_offer_id', None)
+    await update.message.reply_text("Отменено")
+    return ConversationHandler.END
+
+async def timeout_edit_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data.pop('edit_offer_id', None)
+
 # --- Conversation: Добавление оффера ---
 async def start_add_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -549,6 +1275,7 @@ async def add_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
     cur.execute("INSERT INTO offers VALUES(?,?,?,?)", (offer_id, title, desc, price))
     conn.commit()
     conn.close()
+    invalidate_catalog()
     await update.message.reply_text(f"✅ Оффер '{title}' добавлен. Цена: {price/100:.0f} ₽")
     return ConversationHandler.END
 
@@ -562,6 +1289,11 @@ async def cancel_add_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.pop('add_offer_step', None)
     return ConversationHandler.END
 
+async def timeout_add_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Диалог брошен — убираем промежуточные данные
+    for key in ('add_offer_step', 'new_offer_title', 'new_offer_desc'):
+        context.user_data.pop(key, None)
+
 async def back_add_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Возврат на предыдущий шаг диалога добавления оффера
     step = context.user_data.get('add_offer_step')
@@ -600,7 +1332,89 @@ async def back_add_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.callback_query.message.reply_text("Отменено")
         return ConversationHandler.END
 
-# --- Conversation: Добавление демо-пользователя ---
+# --- Conversation: Добавление демо-пользователей ---
+DURATION_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+def parse_demo_grants(text):
+    # Каждая строка: ID через пробел/запятую и необязательный срок (30m, 12h, 7d, 2w),
+    # который относится ко всем ID этой строки. Срок с «!» (7d!) заменяет и бессрочный
+    # доступ. Возвращает ({user_id: (timedelta|None, заменить)}, ошибки).
+    # При ошибочном сроке ID строки не выдаются, чтобы не дать бессрочный доступ
+    grants = {}
+    errors = []
+    for line in text.splitlines():
+        ids = []
+        duration = None
+        force = False
+        bad_duration = False
+        for token in re.split(r"[\s,;]+", line.strip()):
+            if not token:
+                continue
+            match = re.fullmatch(r"([0-9]+)(?:([mhdw])(!?))?", token.lower())
+            if not match:
+                errors.append(token)
+            elif match.group(2) is None:
+                if 0 < int(token) <= MAX_USER_ID:
+                    ids.append(int(token))
+                else:
+                    errors.append(token)
+            else:
+                seconds = int(match.group(1)) * DURATION_UNITS[match.group(2)]
+                if 0 < seconds <= DEMO_MAX_DURATION.total_seconds():
+                    duration = timedelta(seconds=seconds)
+                    force = bool(match.group(3))
+                else:
+                    errors.append(token)
+                    bad_duration = True
+        if bad_duration:
+            errors.extend(str(user_id) for user_id in ids)
+            continue
+        for user_id in ids:
+            grants[user_id] = (duration, force)
+    return grants, errors
+
+def grant_demo_access(grants, admin_id):
+    # Все ID одной пачкой и одним коммитом. Возвращает (добавлено, обновлено,
+    # без изменений). Бессрочный доступ не сокращаем до срочного без «!»
+    now = datetime.utcnow()
+    conn = _conn()
+    cur = conn.cursor()
+    
+    existing = {}
+    user_ids = list(grants)
+    for i in range(0, len(user_ids), 500):
+        chunk = user_ids[i:i + 500]
+        cur.execute(
+            f"SELECT user_id, expires_at FROM demo_exceptions WHERE user_id IN ({','.join('?' * len(chunk))})",
+            chunk
+        )
+        existing.update(cur.fetchall())
+    
+    rows = []
+    added = updated = kept = 0
+    for user_id, (duration, force) in grants.items():
+        if user_id in existing:
+            permanent = existing[user_id] is None
+            if permanent and (duration is None or not force):
+                kept += 1
+                continue
+            updated += 1
+        else:
+            added += 1
+        rows.append((user_id, admin_id, now.isoformat(), (now + duration).isoformat() if duration else None))
+    
+    cur.executemany("""
+        INSERT INTO demo_exceptions (user_id, granted_by, granted_at, expires_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            granted_by = excluded.granted_by,
+            granted_at = excluded.granted_at,
+            expires_at = excluded.expires_at
+    """, rows)
+    conn.commit()
+    conn.close()
+    return added, updated, kept
+
 async def start_add_demo_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -608,37 +1422,75 @@ async def start_add_demo_user(update: Update, context: ContextTypes.DEFAULT_TYPE
         await query.message.reply_text("❌ Доступ запрещён")
         return ConversationHandler.END
     
-    await query.message.reply_text("👤 Введите ID пользователя для предоставления демо-доступа (или /cancel для отмены):")
+    await query.message.reply_text(
+        "👤 Отправьте ID пользователей для демо-доступа — списком или .txt-файлом.\n"
+        "В строке можно указать срок для её ID: 30m, 12h, 7d, 2w. Без срока — бессрочно.\n"
+        "Бессрочный доступ срок не сокращает; чтобы заменить его, добавьте «!»: 7d!\n"
+        "Например:\n123456789 987654321 7d\n555555555\n\n"
+        "/cancel для отмены"
+    )
     return DEMO_USER_ID
 
-async def add_demo_user_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text.strip()
-    if not text.isdigit():
-        await update.message.reply_text("Ошибка: отправьте числовой ID пользователя")
+async def apply_demo_grants(update: Update, text):
+    grants, errors = parse_demo_grants(text)
+    if not grants:
+        await update.message.reply_text("Ошибка: не найдено ни одного числового ID пользователя")
         return DEMO_USER_ID
     
-    user_id = int(text)
-    admin_id = update.effective_user.id
+    added, updated, kept = grant_demo_access(grants, update.effective_user.id)
     
-    # Проверяем, не добавлен ли уже этот пользователь
-    conn = _conn()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM demo_exceptions WHERE user_id = ?", (user_id,))
-    if cur.fetchone()[0] > 0:
-        await update.message.reply_text("❌ Этот пользователь уже имеет демо-доступ")
-        conn.close()
-        return ConversationHandler.END
+    temporary = sum(1 for duration, _ in grants.values() if duration)
+    msg = f"✅ Демо-доступ: добавлено {added}, обновлено {updated}"
+    if kept:
+        msg += f", без изменений (уже бессрочный) {kept}"
+    if temporary:
+        msg += f"\n⏳ Со сроком в списке: {temporary}"
+    if errors:
+        msg += f"\n⚠️ Пропущено нераспознанных значений: {len(errors)} ({', '.join(errors[:5])})"
+    await update.message.reply_text(msg)
+    return ConversationHandler.END
+
+async def add_demo_user_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    return await apply_demo_grants(update, update.message.text)
+
+async def add_demo_user_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    document = update.message.document
+    if document.file_size and document.file_size > DEMO_FILE_MAX_BYTES:
+        await update.message.reply_text("Ошибка: файл больше 1 МБ")
+        return DEMO_USER_ID
     
-    # Добавляем пользователя
-    cur.execute("""
-        INSERT INTO demo_exceptions (user_id, granted_by, granted_at)
-        VALUES (?, ?, ?)
-    """, (user_id, admin_id, datetime.utcnow().isoformat()))
-    conn.commit()
-    conn.close()
+    file = await document.get_file()
+    data = await file.download_as_bytearray()
+    try:
+        text = bytes(data).decode('utf-8-sig')
+    except UnicodeDecodeError:
+        await update.message.reply_text("Ошибка: файл должен быть текстовым в кодировке UTF-8")
+        return DEMO_USER_ID
+    return await apply_demo_grants(update, text)
+
+async def reject_demo_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("Ошибка: принимаются только .txt-файлы со списком ID")
+    return DEMO_USER_ID
+
+async def sweep_expired_demo(context: ContextTypes.DEFAULT_TYPE):
+    # Удаляем истёкшие доступы небольшими пачками по индексу expires_at,
+    # чтобы не держать блокировку БД долго
+    now = datetime.utcnow().isoformat()
+    removed = 0
+    while True:
+        conn = _conn()
+        cur = conn.cursor()
+        cur.execute(SQL_DEMO_SWEEP, (now, DEMO_SWEEP_BATCH))
+        deleted = cur.rowcount
+        conn.commit()
+        conn.close()
+        removed += deleted
+        if deleted == 0 or deleted < DEMO_SWEEP_BATCH:
+            break
+        await asyncio.sleep(0)
     
-    await update.message.reply_text(f"✅ Демо-доступ предоставлен пользователю {user_id}")
-    return ConversationHandler.END
+    if removed:
+        logger.info(f"Удалено истёкших демо-доступов: {removed}")
 
 async def cancel_add_demo_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.callback_query:
@@ -660,25 +1512,22 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     cur = conn.cursor()
     
     # Общая статистика
-    cur.execute("SELECT COUNT(*), SUM(paid_amount) FROM orders WHERE status = 'paid'")
+    cur.execute(SQL_STATS_TOTAL)
     total_orders, total_revenue = cur.fetchone()
     total_revenue = total_revenue or 0
     
     # Статистика за сегодня
     today = datetime.utcnow().date().isoformat()
-    cur.execute("""
-        SELECT COUNT(*), SUM(paid_amount) FROM orders 
-        WHERE status = 'paid' AND date(created_at) = ?
-    """, (today,))
+    cur.execute(SQL_STATS_TODAY, (today,))
     today_orders, today_revenue = cur.fetchone()
     today_revenue = today_revenue or 0
     
     # Количество офферов
-    cur.execute("SELECT COUNT(*) FROM offers")
+    cur.execute(SQL_COUNT_OFFERS)
     offers_count = cur.fetchone()[0]
     
     # Количество демо-пользователей
-    cur.execute("SELECT COUNT(*) FROM demo_exceptions")
+    cur.execute(SQL_COUNT_DEMO_USERS)
     demo_users_count = cur.fetchone()[0]
     
     conn.close()
@@ -702,6 +1551,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     text = ("ℹ️ Помощь:\n\n"
             "🎯 Доступные офферы - просмотр и покупка товаров\n"
+            "🛒 Корзина - несколько товаров одним платежом\n"
             "📋 Мои заказы - история ваших покупок\n\n"
             "💳 Для оплаты используются банковские карты\n"
             "🔐 Все платежи защищены Telegram Payments\n\n"
@@ -716,8 +1566,12 @@ async def back_to_main(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 ### Регистрация хендлеров
 def setup_handlers(application: Application):
+    # Учёт активности для выгрузки состояния — до всех остальных хендлеров
+    application.add_handler(TypeHandler(Update, track_activity), group=-1)
+
     # Основные команды
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("state", state_info))
 
     # Conversation для добавления оффера (админ)
     conv_add = ConversationHandler(
@@ -726,9 +1580,11 @@ def setup_handlers(application: Application):
             TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_title)],
             DESC: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_desc)],
             PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_price)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, timeout_add_offer)],
         },
         fallbacks=[CommandHandler('cancel', cancel_add_offer), CommandHandler('back', back_add_offer)],
-        allow_reentry=True
+        allow_reentry=True,
+        conversation_timeout=CONVERSATION_TIMEOUT_SECONDS
     )
     application.add_handler(conv_add)
 
@@ -736,16 +1592,40 @@ def setup_handlers(application: Application):
     conv_demo = ConversationHandler(
         entry_points=[CallbackQueryHandler(start_add_demo_user, pattern='^add_demo_user$')],
         states={
-            DEMO_USER_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_demo_user_id)],
+            DEMO_USER_ID: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, add_demo_user_id),
+                MessageHandler(filters.Document.TXT, add_demo_user_file),
+                MessageHandler(filters.Document.ALL, reject_demo_file),
+            ],
         },
         fallbacks=[CommandHandler('cancel', cancel_add_demo_user)],
-        allow_reentry=True
+        allow_reentry=True,
+        conversation_timeout=CONVERSATION_TIMEOUT_SECONDS
     )
     application.add_handler(conv_demo)
 
+    # Conversation для изменения названия оффера (админ)
+    conv_edit_title = ConversationHandler(
+        entry_points=[CallbackQueryHandler(start_edit_title, pattern='^edit_title_')],
+        states={
+            EDIT_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_title)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, timeout_edit_title)],
+        },
+        fallbacks=[CommandHandler('cancel', cancel_edit_title)],
+        allow_reentry=True,
+        conversation_timeout=CONVERSATION_TIMEOUT_SECONDS
+    )
+    application.add_handler(conv_edit_title)
+
     # Callback handlers
     application.add_handler(CallbackQueryHandler(show_offers, pattern='^show_offers$'))
+    application.add_handler(CallbackQueryHandler(show_offers, pattern=r'^offers_page_\d+$'))
     application.add_handler(CallbackQueryHandler(buy_offer, pattern='^buy_'))
+    application.add_handler(CallbackQueryHandler(show_cart, pattern='^show_cart$'))
+    application.add_handler(CallbackQueryHandler(cart_add, pattern='^cart_add_'))
+    application.add_handler(CallbackQueryHandler(cart_remove, pattern='^cart_remove_'))
+    application.add_handler(CallbackQueryHandler(cart_clear, pattern='^cart_clear$'))
+    application.add_handler(CallbackQueryHandler(cart_checkout, pattern='^cart_checkout$'))
     application.add_handler(CallbackQueryHandler(my_orders, pattern='^my_orders$'))
     application.add_handler(CallbackQueryHandler(help_command, pattern='^help$'))
     application.add_handler(CallbackQueryHandler(back_to_main, pattern='^back_to_main$'))
@@ -758,12 +1638,17 @@ def setup_handlers(application: Application):
     # Демо-управление
     application.add_handler(CallbackQueryHandler(manage_demo, pattern='^manage_demo$'))
     application.add_handler(CallbackQueryHandler(list_demo_users, pattern='^list_demo_users$'))
+    application.add_handler(CallbackQueryHandler(list_demo_users, pattern=r'^demo_page_\d+$'))
     application.add_handler(CallbackQueryHandler(remove_demo_user, pattern='^remove_demo_'))
 
-    # Офферы: список/удаление/редактирование-заглушка
+    # Офферы: список/удаление/редактирование
     application.add_handler(CallbackQueryHandler(list_offers_admin, pattern='^list_offers$'))
+    application.add_handler(CallbackQueryHandler(list_offers_admin, pattern=r'^admin_offers_page_\d+$'))
     application.add_handler(CallbackQueryHandler(delete_offer, pattern='^delete_offer_'))
-    application.add_handler(CallbackQueryHandler(edit_offer_placeholder, pattern='^edit_offer_'))
+    application.add_handler(CallbackQueryHandler(edit_offer, pattern='^edit_offer_'))
+
+    # Inline-поиск по офферам (inline-режим включается в @BotFather)
+    application.add_handler(InlineQueryHandler(inline_search))
 
     # Платежные хендлеры
     application.add_handler(PreCheckoutQueryHandler(checkout))
@@ -774,6 +1659,7 @@ def main():
     # Инициализация базы данных
     init_db()
     add_sample_offers()
+    get_catalog()
     
     # Инициализация приложения
     application = ApplicationBuilder().token(BOT_TOKEN).build()
@@ -781,6 +1667,17 @@ def main():
     # Регистрация хендлеров
     setup_handlers(application)
     
+    # Периодическая выгрузка неактивного состояния (нужен python-telegram-bot[job-queue])
+    if application.job_queue:
+        application.job_queue.run_repeating(
+            sweep_state, interval=STATE_SWEEP_INTERVAL_SECONDS, first=STATE_SWEEP_INTERVAL_SECONDS
+        )
+        application.job_queue.run_repeating(sweep_expired_demo, interval=DEMO_SWEEP_INTERVAL_SECONDS, first=10)
+        application.job_queue.run_repeating(watch_offers, interval=OFFERS_WATCH_INTERVAL_SECONDS, first=0)
+    else:
+        logger.warning("JobQueue недоступна: таймауты диалогов, выгрузка состояния, "
+                       "очистка истёкших демо-доступов и отслеживание правок офферов отключены")
+    
     logger.info("Bot started...")
     
     # Запуск бота